@@ -246,12 +246,33 @@ ASGI_APPLICATION = "edgesync.asgi.application"
 
 # Channel layers configuration
 # For development, use in-memory channel layer (single-process only)
-# For production, use Redis: channels_redis.core.RedisChannelLayer
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer",
-    },
-}
+# For production, set REDIS_URL to use the Redis Pub/Sub layer: each
+# group_send is a single PUBLISH instead of one RPUSH per subscribed channel.
+# Delivery is fire-and-forget, which suits live sensor/widget streams.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
+        },
+    }
+    # Share the cache across workers too: device encryption keys and the
+    # websocket viewer counts must be visible to every process.
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer",
+        },
+    }
 
 # Django REST Framework configuration
 REST_FRAMEWORK = {
@@ -263,7 +284,12 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
+        'sensors.renderers.OrjsonRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'sensors.renderers.OrjsonParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
     ],
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 }
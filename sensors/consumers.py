@@ -1,24 +1,250 @@
-import json
+import asyncio
+import hashlib
 import logging
 import base64
+import time
+import orjson
+from cachetools import TTLCache
+from collections import defaultdict, namedtuple
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer
 from .models import SensorData, Device, TrackedVariable, WidgetSample
 from .utils.device_encryption import device_encryption_manager
 import urllib.parse
-from rest_framework_simplejwt.tokens import UntypedToken
+from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from django.utils import timezone
-import base64
+from django.core.cache import cache
+from django.db import DataError, connections, router
 
 logger = logging.getLogger(__name__)
 
+
+def _extract_token(query_string):
+    """Return the ``token`` query parameter from a raw ASGI query string.
+
+    Clients only ever send ``?token=<TOKEN>``, so scan the bytes directly
+    instead of building the dict-of-lists that ``parse_qs`` allocates.
+    Device tokens and JWTs are URL-safe, so percent-decoding is only run
+    when the value actually contains an escape.
+    """
+    for part in query_string.split(b"&"):
+        if part.startswith(b"token="):
+            value = part[6:].decode()
+            if "%" in value or "+" in value:
+                value = urllib.parse.unquote_plus(value)
+            return value or None
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Viewer bookkeeping – lets producers skip group_send for groups nobody reads
+# ---------------------------------------------------------------------------
+
+# Viewers attached to each group in *this* worker process.
+_viewer_counts = defaultdict(int)
+
+VIEWER_COUNT_CACHE_KEY = "ws_group_viewers_{}"
+
+
+async def _add_viewer(group):
+    """Register a viewer socket for ``group`` locally and in the shared cache."""
+    _viewer_counts[group] += 1
+    key = VIEWER_COUNT_CACHE_KEY.format(group)
+    await cache.aadd(key, 0, None)
+    await cache.aincr(key)
+
+
+async def _remove_viewer(group):
+    """Undo :func:`_add_viewer` when a viewer socket goes away."""
+    _viewer_counts[group] = max(_viewer_counts[group] - 1, 0)
+    try:
+        await cache.adecr(VIEWER_COUNT_CACHE_KEY.format(group))
+    except ValueError:
+        pass  # Key evicted – the next viewer connect re-creates it
+
+
+async def _has_viewers(channel_layer, group):
+    """Return True if any viewer may be listening on ``group``.
+
+    The local counter is authoritative for the in-memory channel layer. With
+    a shared layer (e.g. Redis) viewers may sit on other workers, so fall back
+    to the cache-wide count. A worker that dies without disconnecting leaves
+    that count too high, which only costs an unnecessary broadcast.
+    """
+    if _viewer_counts[group]:
+        return True
+    if isinstance(channel_layer, InMemoryChannelLayer):
+        return False
+    return bool(await cache.aget(VIEWER_COUNT_CACHE_KEY.format(group)))
+
+
+# ---------------------------------------------------------------------------
+# JWT authentication with a short-lived cache of validated tokens
+# ---------------------------------------------------------------------------
+
+# blake2b(token) -> (user, exp). Reconnecting dashboards present the same token
+# repeatedly; a hit skips signature verification and the auth_user lookup.
+# Entries live at most JWT_CACHE_TTL seconds and never past the token's exp.
+# All access happens on the event loop thread without awaiting in between, so
+# no lock is needed.
+JWT_CACHE_TTL = 30
+_jwt_cache = TTLCache(maxsize=10000, ttl=JWT_CACHE_TTL)
+
+# Stateless, so one instance serves every connection
+_JWT_AUTH = JWTAuthentication()
+
+
+async def _authenticate_jwt(token):
+    """Return the user for a JWT, raising InvalidToken/TokenError if invalid."""
+    cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+    cached = _jwt_cache.get(cache_key)
+    if cached is not None:
+        user, exp = cached
+        if exp > time.time():
+            return user
+        del _jwt_cache[cache_key]
+
+    # Validates signature & expiry once (raises InvalidToken)
+    validated_token = _JWT_AUTH.get_validated_token(token)
+    user = await database_sync_to_async(_JWT_AUTH.get_user)(validated_token)
+    _jwt_cache[cache_key] = (user, validated_token['exp'])
+    return user
+
+
+# ---------------------------------------------------------------------------
+# Message processing limits
+# ---------------------------------------------------------------------------
+
+# Without the PostgreSQL prune trigger, widget buffers are pruned to
+# max_samples every TRIM_EVERY_SAMPLES inserts rather than after each one.
+# Counters are per tracked variable pk.
+TRIM_EVERY_SAMPLES = 50
+_samples_since_trim = defaultdict(int)
+
+# A widget worker flush writes at most this many readings in one go
+WIDGET_FLUSH_MAX_READINGS = 100
+
+# Readings per sensor_data_batch channel-layer message
+BROADCAST_CHUNK_SIZE = 128
+
+# Fixed reply frames, encoded once
+INVALID_JSON_FRAME = orjson.dumps({
+    'status': 'error',
+    'message': 'Invalid JSON format'
+}).decode()
+
+
+# ---------------------------------------------------------------------------
+# Device token lookups
+# ---------------------------------------------------------------------------
+
+# token -> DeviceRef. Devices reconnect often (WiFi drops, reboots), so serve
+# repeat connects without a query. Token regeneration/deletion evicts the
+# entry through forget_device_token(); other workers expire it after the TTL.
+DEVICE_TOKEN_CACHE_TTL = 300
+_device_by_token = TTLCache(maxsize=5000, ttl=DEVICE_TOKEN_CACHE_TTL)
+
+# Longer tokens cannot match Device.token, so they never reach the database
+DEVICE_TOKEN_MAX_LENGTH = Device._meta.get_field('token').max_length
+
+# Tokens that matched no device, kept briefly so repeated guesses or a
+# misconfigured device retrying in a loop do not each cost a query.
+UNKNOWN_DEVICE_TOKEN_CACHE_TTL = 30
+_unknown_device_tokens = TTLCache(maxsize=10000, ttl=UNKNOWN_DEVICE_TOKEN_CACHE_TTL)
+
+
+# The consumer only needs a device's pk and uuid, so the connect-path lookup
+# is a single-row query on the unique token index without ORM query
+# compilation or model instantiation.
+DeviceRef = namedtuple('DeviceRef', ('pk', 'uuid'))
+_DEVICE_BY_TOKEN_SQL = 'SELECT {pk}, {uuid} FROM {table} WHERE {token} = %s'.format(
+    pk=Device._meta.pk.column,
+    uuid=Device._meta.get_field('uuid').column,
+    table=Device._meta.db_table,
+    token=Device._meta.get_field('token').column,
+)
+
+
+def _fetch_device_by_token(token):
+    """Return a DeviceRef for ``token`` (raises Device.DoesNotExist)."""
+    connection = connections[router.db_for_read(Device)]
+    with connection.cursor() as cursor:
+        cursor.execute(_DEVICE_BY_TOKEN_SQL, [token])
+        row = cursor.fetchone()
+    if row is None:
+        raise Device.DoesNotExist
+    # Backends without a native uuid type hand back the stored hex string
+    return DeviceRef(row[0], Device._meta.get_field('uuid').to_python(row[1]))
+
+
+async def _get_device_by_token(token):
+    """Return the DeviceRef owning ``token`` (raises Device.DoesNotExist)."""
+    device = _device_by_token.get(token)
+    if device is None:
+        if token in _unknown_device_tokens:
+            raise Device.DoesNotExist
+        try:
+            device = await database_sync_to_async(_fetch_device_by_token)(token)
+        except Device.DoesNotExist:
+            _unknown_device_tokens[token] = True
+            raise
+        _device_by_token[token] = device
+    return device
+
+
+def forget_device_token(token):
+    """Drop a cached token → device mapping (call when a token stops being valid)."""
+    _device_by_token.pop(token, None)
+
+
+# device uuid -> (encryption key, encoded device_info frame), held per process
+# for DEVICE_TOKEN_CACHE_TTL seconds. A reconnect within that window gets the
+# same bytes without a cache round trip or re-encoding.
+_device_info_cache = TTLCache(maxsize=5000, ttl=DEVICE_TOKEN_CACHE_TTL)
+
+
+async def _get_device_info(device_uuid_str):
+    """Return ``(key, device_info text)`` for a device, building it on a miss."""
+    cached = _device_info_cache.get(device_uuid_str)
+    if cached is None:
+        device_key = await database_sync_to_async(
+            device_encryption_manager.get_device_key
+        )(device_uuid_str)
+        cached = (device_key, orjson.dumps({
+            "type": "device_info",
+            "device_uuid": device_uuid_str,
+            "encryption_key": base64.b64encode(device_key).decode(),
+            "encryption_enabled": True
+        }).decode())
+        _device_info_cache[device_uuid_str] = cached
+    return cached
+
+
+# Keys a single-reading ESP32 payload must carry
+ESP32_REQUIRED_FIELDS = frozenset(('device_id', 'sensor_type', 'value'))
+
+
+def _has_encrypted_values(data):
+    """Return True if the payload carries any value flagged ``encrypted``"""
+    if not isinstance(data, dict):
+        return False
+    if data.get("encrypted"):
+        return True
+    readings = data.get("readings")
+    if isinstance(readings, list):
+        return any(isinstance(reading, dict) and reading.get("encrypted") for reading in readings)
+    return False
+
+
 class SensorDataConsumer(AsyncWebsocketConsumer):
     """WebSocket consumer for handling ESP32 sensor data and web client connections"""
     
     async def connect(self):
         """Handle WebSocket connection"""
         self.room_group_name = 'sensor_data'
+        self.viewer_registered = False
         
         # --- Authentication -------------------------------------------------
         # We support two authentication mechanisms:
@@ -29,41 +255,59 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
         # -------------------------------------------------------------------
 
         # Check for device token in the query params
-        query_params = urllib.parse.parse_qs(self.scope.get("query_string", b"").decode())
-        token_param = query_params.get("token", [None])[0]
+        query_string = self.scope.get("query_string", b"")
+        token_param = _extract_token(query_string)
+        # Viewers that opt in with ?batch=1 get each device message as one
+        # {"type": "batch", "items": [...]} frame instead of a frame per reading
+        self.batch_frames = b"batch=1" in query_string.split(b"&")
 
         self.device = None
+        self.device_uuid_str = None  # canonical device id, stringified once
+        self._device_key = None  # encryption key, fetched once per connection
+        self.encryption_enabled = False  # what device_info advertised to the device
         self.is_device = False  # flag to indicate this socket belongs to a device
+        # Last (value, unit) persisted per tracked variable, used to drop
+        # repeated readings from slow-changing sensors.
+        self._last_widget_value = {}
+        # Widget persistence runs off the ack path in a per-device worker
+        self._widget_queue = None
+        self._widget_worker_task = None
 
         # If a token was supplied, try to authenticate device
         if token_param:
             # -------------------------------------------------------------------
-            # 1) Attempt device-token authentication. This may raise various DB-
-            #    related exceptions (e.g. when the provided token is much longer
-            #    than the max_length of the field in some backends). We catch a
-            #    broad Exception here to gracefully fall back to JWT handling.
+            # 1) Attempt device-token authentication. Device tokens are
+            #    url-safe base64 and never contain dots, so JWTs (header.
+            #    payload.signature) skip the lookup entirely, and tokens too
+            #    long for Device.token cannot match so they skip it as well.
+            #    The lookup may still raise DataError/ValueError for malformed
+            #    tokens on some backends; those are rejected like unknown ones.
             # -------------------------------------------------------------------
-            try:
-                self.device = await database_sync_to_async(Device.objects.get)(token=token_param)
-                self.is_device = True
-            except Device.DoesNotExist:
-                pass  # Will attempt JWT handling below
-            except Exception as e:  # e.g. DataError, ValueError, etc.
-                logger.debug(f"Token did not match a device record – treating as JWT. Details: {e}")
-
-            # If not resolved as device, interpret as (potential) JWT for a user
-            if not self.is_device:
+            is_jwt = token_param.count('.') == 2
+            if not is_jwt and len(token_param) <= DEVICE_TOKEN_MAX_LENGTH:
                 try:
-                    UntypedToken(token_param)  # validates signature & expiry
-                    from rest_framework_simplejwt.authentication import JWTAuthentication
-                    jwt_auth = JWTAuthentication()
-                    validated_token = jwt_auth.get_validated_token(token_param)
-                    user = await database_sync_to_async(jwt_auth.get_user)(validated_token)
-                    self.scope["user"] = user
-                except (InvalidToken, TokenError) as e:
+                    self.device = await _get_device_by_token(token_param)
+                    self.device_uuid_str = str(self.device.uuid)
+                    self.is_device = True
+                except Device.DoesNotExist:
+                    pass
+                except (DataError, ValueError) as e:
+                    logger.debug("Token lookup failed for device authentication. Details: %s", e)
+
+            # 2) Otherwise interpret as a JWT for a user. Anything that is
+            #    neither a known device token nor JWT-shaped cannot verify.
+            if not self.is_device:
+                user = None
+                if is_jwt:
+                    try:
+                        user = await _authenticate_jwt(token_param)
+                    except (InvalidToken, TokenError):
+                        pass
+                if user is None:
                     logger.warning("Invalid auth token provided – connection rejected")
                     await self.close(code=4001)
                     return
+                self.scope["user"] = user
 
         # If no valid device token, fall back to user authentication
         if not self.is_device:
@@ -73,42 +317,47 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
                 await self.close(code=4003)  # 4003 -> policy violation / auth required
                 return
 
-        # At this point authentication succeeded – join the broadcast group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
-
-        await self.accept()
+        # At this point authentication succeeded – join the broadcast group.
+        # Group membership does not depend on the handshake, so the channel
+        # layer round trips overlap with the accept.
+        if not self.is_device:
+            await asyncio.gather(
+                self.channel_layer.group_add(self.room_group_name, self.channel_name),
+                self.accept(),
+                _add_viewer(self.room_group_name),
+            )
+            self.viewer_registered = True
+        else:
+            await asyncio.gather(
+                self.channel_layer.group_add(self.room_group_name, self.channel_name),
+                self.accept(),
+            )
+            self._widget_queue = asyncio.Queue()
+            self._widget_worker_task = asyncio.create_task(self._widget_worker())
 
         # If this socket belongs to a device, send its canonical UUID so the
         # firmware/client does not need to hard-code or separately fetch it.
         if self.is_device and self.device:
             try:
-                # Generate or retrieve device encryption key
-                device_key = await database_sync_to_async(
-                    device_encryption_manager.get_device_key
-                )(str(self.device.uuid))
+                # Generate or retrieve device encryption key and its
+                # device_info frame (reused across reconnects)
+                self._device_key, device_info = await _get_device_info(self.device_uuid_str)
                 
                 # Send device info with encryption key
-                await self.send(text_data=json.dumps({
-                    "type": "device_info",
-                    "device_uuid": str(self.device.uuid),
-                    "encryption_key": base64.b64encode(device_key).decode(),
-                    "encryption_enabled": True
-                }))
+                await self.send(text_data=device_info)
+                self.encryption_enabled = True
             except Exception as e:
-                logger.debug(f"Failed to send device_info payload: {e}")
+                logger.debug("Failed to send device_info payload: %s", e)
                 # Fallback without encryption
-                await self.send(text_data=json.dumps({
-                    "type": "device_info", 
-                    "device_uuid": str(self.device.uuid),
+                await self.send(text_data=orjson.dumps({
+                    "type": "device_info",
+                    "device_uuid": self.device_uuid_str,
                     "encryption_enabled": False
-                }))
+                }).decode())
 
         logger.info(
-            f"WebSocket connection established: {self.channel_name} |"
-            f" type={'device' if self.is_device else 'viewer'}"
+            "WebSocket connection established: %s | type=%s",
+            self.channel_name, 'device' if self.is_device else 'viewer'
         )
     
     async def disconnect(self, close_code):
@@ -118,7 +367,13 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
-        logger.info(f"WebSocket connection closed: {self.channel_name}, code: {close_code}")
+        if self.viewer_registered:
+            await _remove_viewer(self.room_group_name)
+        if self._widget_worker_task is not None:
+            # Let the worker flush what is already queued, then stop
+            self._widget_queue.put_nowait(None)
+            await self._widget_worker_task
+        logger.info("WebSocket connection closed: %s, code: %s", self.channel_name, close_code)
     
     async def receive(self, text_data):
         """Handle incoming WebSocket messages"""
@@ -127,224 +382,351 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
         if not self.is_device:
             logger.debug("Ignoring data received from non-device client")
             return
+        # One receive timestamp shared by every reading in this message
+        now = timezone.now()
         try:
-            data = json.loads(text_data)
-            logger.info(f"Received data: {data}")
-            
-            # Decrypt data if encrypted
+            data = orjson.loads(text_data)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received data: %s", data)
+
+            # Decrypt, validate and save in one thread hop
+            processed = await self._process_payload_sync(data, now)
+            if processed is None:
+                # Handle other types of messages (e.g., from web clients)
+                logger.debug("Non-sensor data received from device: %s", data)
+                return
+            is_bulk, reading_payloads, saved_ids = processed
+
+            # Widget samples are persisted by the background worker so the
+            # ack below does not wait on them
+            if saved_ids:
+                self._widget_queue.put_nowait([
+                    # Use original value for widgets too
+                    (payload['sensor_type'], payload['value'], payload['unit'], now)
+                    for payload in reading_payloads
+                ])
+
+            # One frame per reading so existing frontend code keeps working.
+            # Everything but the id comes from the validated payload and the
+            # receive timestamp every row was stamped with.
+            batch = [
+                orjson.dumps({
+                    'type': 'sensor_data',
+                    'device_id': payload['device_id'],
+                    'sensor_type': payload['sensor_type'],
+                    'value': payload['value'],  # Use original value, not the stored float
+                    'unit': payload['unit'],
+                    'timestamp': now,
+                    'id': saved_id
+                }).decode()
+                for payload, saved_id in zip(reading_payloads, saved_ids)
+            ]
+
+            await self._broadcast_sensor_data(batch)
+
+            # Send confirmation back to ESP32
+            if is_bulk:
+                await self.send(text_data=orjson.dumps({
+                    'status': 'success',
+                    'message': f'{len(saved_ids)} readings received and saved'
+                }).decode())
+            else:
+                await self.send(text_data=orjson.dumps({
+                    'status': 'success',
+                    'message': 'Data received and saved',
+                    'id': saved_ids[0]
+                }).decode())
+
+        except orjson.JSONDecodeError:
+            logger.error("Invalid JSON received: %s", text_data)
+            await self.send(text_data=INVALID_JSON_FRAME)
+        except Exception as e:
+            logger.error("Error processing message: %s", e)
+            await self.send(text_data=orjson.dumps({
+                'status': 'error',
+                'message': str(e)
+            }).decode())
+
+    @database_sync_to_async
+    def _process_payload_sync(self, data, timestamp):
+        """Decrypt, validate and persist one device message.
+
+        Everything that touches the key store or the database runs here so a
+        message costs a single executor round trip. Returns ``None`` for
+        payloads that are not sensor data, otherwise ``(is_bulk,
+        reading_payloads, saved_ids)``.
+        """
+        # Decrypt data if encrypted. Devices that were told encryption is off,
+        # and plaintext payloads, skip the crypto path entirely.
+        if self.encryption_enabled and _has_encrypted_values(data):
+            # Reuse the key handed to the device in connect()
+            if self._device_key is None:
+                self._device_key = device_encryption_manager.get_device_key(self.device_uuid_str)
+
+            data = device_encryption_manager.decrypt_sensor_values(data, self._device_key)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Decrypted data: %s", data)
+
+        # Support two payload formats:
+        # 1) Single reading: {device_id, sensor_type, value, unit}
+        # 2) Bulk readings:  {device_id, readings: [{sensor_type, value, unit?}, ...]}
+        if "readings" in data:
+            # ---------------------------- BULK READINGS -----------------------------
+            # Normalise device_id to canonical UUID when authenticated device
             if self.device:
-                device_key = await database_sync_to_async(
-                    device_encryption_manager.get_device_key
-                )(str(self.device.uuid))
-                
-                data = await database_sync_to_async(
-                    device_encryption_manager.decrypt_sensor_values
-                )(data, device_key)
-                
-                logger.info(f"Decrypted data: {data}")
-            
-            # Support two payload formats:
-            # 1) Single reading: {device_id, sensor_type, value, unit}
-            # 2) Bulk readings:  {device_id, readings: [{sensor_type, value, unit?}, ...]}
-            if "readings" in data:
-                # ---------------------------- BULK READINGS -----------------------------
-                # Normalise device_id to canonical UUID when authenticated device
-                if self.device:
-                    data["device_id"] = str(self.device.uuid)
-                device_id = data.get("device_id")
-
-                readings = data["readings"]
-                # Allow {"temperature": 25.4, "humidity": 60} style objects as shorthand
-                if isinstance(readings, dict):
-                    readings = [
-                        {"sensor_type": k, "value": v} for k, v in readings.items()
-                    ]
-
-                saved_count = 0
-                for reading in readings:
-                    reading_payload = {
+                data["device_id"] = self.device_uuid_str
+            device_id = data.get("device_id")
+
+            readings = data["readings"]
+            if isinstance(readings, dict):
+                # {"temperature": 25.4, "humidity": 60} shorthand – build the
+                # payloads straight from the mapping
+                reading_payloads = [
+                    {
                         "device_id": device_id,
-                        "sensor_type": reading.get("sensor_type") or reading.get("type"),
-                        "value": reading.get("value"),
-                        "unit": reading.get("unit", "")
+                        "sensor_type": sensor_type,
+                        "value": value,
+                        "unit": ""
                     }
-                    if not self.is_esp32_data(reading_payload):
-                        logger.debug(f"Skipping invalid reading fragment: {reading}")
+                    for sensor_type, value in readings.items()
+                    if sensor_type and value is not None
+                ]
+            else:
+                reading_payloads = []
+                for reading in readings:
+                    sensor_type = reading.get("sensor_type") or reading.get("type")
+                    # Keep the original value for broadcasting (important for string sensors)
+                    original_value = reading.get("value")
+                    if sensor_type is None or original_value is None:
+                        logger.debug("Skipping invalid reading fragment: %s", reading)
                         continue
 
-                    sensor_data = await self.save_sensor_data(reading_payload)
-                    saved_count += 1
-
-                    # Get the original value for broadcasting (important for string sensors)
-                    original_value = reading.get("value")
-                    
-                    broadcast_data = {
-                        'type': 'sensor_data',
-                        'device_id': device_id,
-                        'sensor_type': sensor_data.sensor_type,
-                        'value': original_value,  # Use original value, not the stored float
-                        'unit': sensor_data.unit,
-                        'timestamp': sensor_data.timestamp.isoformat(),
-                        'id': sensor_data.id
-                    }
+                    reading_payloads.append({
+                        "device_id": device_id,
+                        "sensor_type": sensor_type,
+                        "value": original_value,
+                        "unit": reading.get("unit") or ""
+                    })
+
+            # Save every reading with a single INSERT
+            saved_rows = SensorData.bulk_create_from_esp32_data(reading_payloads, timestamp=timestamp)
+            is_bulk = True
+
+        elif self.is_esp32_data(data):
+            # ---------------------------- SINGLE READING -----------------------------
+            # Override device_id with canonical UUID if authenticated device
+            if self.device:
+                data["device_id"] = self.device_uuid_str
 
-                    # Broadcast each reading independently so existing frontend code keeps working
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'sensor_data_message',
-                            'data': broadcast_data
-                        }
-                    )
-
-                    # ---------------- Persist / broadcast for widgets ----------------
-                    await self._handle_widget_tracking(
-                        device_id=device_id,
-                        sensor_type=sensor_data.sensor_type,
-                        value=original_value,  # Use original value for widgets too
-                        unit=sensor_data.unit,
-                        timestamp=sensor_data.timestamp,
-                    )
-
-                await self.send(text_data=json.dumps({
-                    'status': 'success',
-                    'message': f'{saved_count} readings received and saved'
-                }))
+            saved_rows = [SensorData.create_from_esp32_data(data, timestamp=timestamp)]
+            reading_payloads = [{
+                "device_id": data["device_id"],
+                "sensor_type": data["sensor_type"],
+                "value": data["value"],
+                "unit": data.get("unit", "")
+            }]
+            is_bulk = False
 
-            elif self.is_esp32_data(data):
-                # ---------------------------- SINGLE READING -----------------------------
-                # Override device_id with canonical UUID if authenticated device
-                if self.device:
-                    data["device_id"] = str(self.device.uuid)
+        else:
+            return None
 
-                # Save to database
-                sensor_data = await self.save_sensor_data(data)
-                
-                # Get the original value for broadcasting
-                original_value = data.get("value")
-                
-                # Prepare data for broadcasting
-                broadcast_data = {
-                    'type': 'sensor_data',
-                    'device_id': str(self.device.uuid) if self.device else sensor_data.device_id,
-                    'sensor_type': sensor_data.sensor_type,
-                    'value': original_value,  # Use original value, not the stored float
-                    'unit': sensor_data.unit,
-                    'timestamp': sensor_data.timestamp.isoformat(),
-                    'id': sensor_data.id
-                }
-                
-                # Broadcast to all connected clients
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'sensor_data_message',
-                        'data': broadcast_data
-                    }
-                )
+        return is_bulk, reading_payloads, [row.id for row in saved_rows]
 
-                await self._handle_widget_tracking(
-                    device_id=broadcast_data['device_id'],
-                    sensor_type=broadcast_data['sensor_type'],
-                    value=original_value,  # Use original value for widget tracking
-                    unit=broadcast_data['unit'],
-                    timestamp=timezone.now(),
-                )
-                
-                # Send confirmation back to ESP32
-                await self.send(text_data=json.dumps({
-                    'status': 'success',
-                    'message': 'Data received and saved',
-                    'id': sensor_data.id
-                }))
-            else:
-                # Handle other types of messages (e.g., from web clients)
-                logger.info(f"Non-sensor data received from device: {data}")
-                
-        except json.JSONDecodeError:
-            logger.error(f"Invalid JSON received: {text_data}")
-            await self.send(text_data=json.dumps({
-                'status': 'error',
-                'message': 'Invalid JSON format'
-            }))
-        except Exception as e:
-            logger.error(f"Error processing message: {e}")
-            await self.send(text_data=json.dumps({
-                'status': 'error',
-                'message': str(e)
-            }))
-    
     async def sensor_data_message(self, event):
         """Handle sensor data broadcast to all clients"""
-        data = event['data']
-        
-        # Send message to WebSocket
-        await self.send(text_data=json.dumps(data))
+        # Payload is serialized once by the producer, not once per subscriber
+        await self.send(text_data=event['text'])
+
+    async def sensor_data_batch(self, event):
+        """Handle a batch of sensor data broadcasts from one device message"""
+        if self.batch_frames:
+            # Items are already-encoded objects, so splice them into the array
+            await self.send(
+                text_data='{"type":"batch","items":[' + ','.join(event['texts']) + ']}'
+            )
+            return
+        for text in event['texts']:
+            await self.send(text_data=text)
     
-    def is_esp32_data(self, data):
+    @staticmethod
+    def is_esp32_data(data):
         """Check if the received data is from an ESP32 device"""
-        required_fields = ['device_id', 'sensor_type', 'value']
-        return all(field in data for field in required_fields)
+        return isinstance(data, dict) and data.keys() >= ESP32_REQUIRED_FIELDS
     
-    @database_sync_to_async
-    def save_sensor_data(self, data):
-        """Save sensor data to database"""
-        return SensorData.create_from_esp32_data(data) 
-
     # ---------------------------------------------------------------------
     # Widget tracking helpers
     # ---------------------------------------------------------------------
 
-    async def _handle_widget_tracking(self, *, device_id: str, sensor_type: str, value, unit: str, timestamp):
-        """Persist sample & broadcast to any widgets that track this variable."""
-        tracked_vars = await database_sync_to_async(list)(
-            TrackedVariable.objects.filter(device_id=device_id, sensor_type=sensor_type)
-        )
-        if not tracked_vars:
-            return
+    async def _widget_worker(self):
+        """Persist and broadcast widget samples queued by ``receive``.
+
+        Each flush takes everything queued while the previous one was
+        running (up to WIDGET_FLUSH_MAX_READINGS), so a busy device gets its
+        widget writes batched without delaying quiet ones. A ``None`` item
+        stops the worker after the readings queued before it are flushed.
+        """
+        queue = self._widget_queue
+        stopping = False
+        while not stopping:
+            item = await queue.get()
+            if item is None:
+                return
+            readings = list(item)
+            while len(readings) < WIDGET_FLUSH_MAX_READINGS and not queue.empty():
+                item = queue.get_nowait()
+                if item is None:
+                    stopping = True
+                    break
+                readings.extend(item)
 
-        for tv in tracked_vars:
-            # Convert value to appropriate type for storage
-            # WidgetSample expects a float value field, so we need to handle string sensors
-            if isinstance(value, str):
-                # For string sensors, we'll store 0.0 as the numeric value
-                # and rely on the actual value being in the broadcast data
-                numeric_value = 0.0
-            else:
-                try:
-                    numeric_value = float(value)
-                except (ValueError, TypeError):
-                    numeric_value = 0.0
-                    
-            # Save sample
-            await database_sync_to_async(WidgetSample.objects.create)(
-                widget=tv,
-                timestamp=timestamp,
-                value=numeric_value,
-                unit=unit,
-            )
+            try:
+                widget_updates = await database_sync_to_async(self._store_widget_samples)(
+                    device_id=self.device_uuid_str,
+                    readings=readings,
+                )
+                await self._broadcast_widget_updates(widget_updates)
+            except Exception as e:
+                logger.error("Error persisting widget samples: %s", e)
 
-            # Trim to max_samples
-            await database_sync_to_async(self._trim_samples)(tv)
+    def _store_widget_samples(self, *, device_id, readings):
+        """Persist samples for any widgets that track these variables.
 
-            # Broadcast to widget group - use original value in broadcast
-            await self.channel_layer.group_send(
-                f'widget_{tv.widget_id}',
-                {
-                    'type': 'widget_update',
-                    'payload': {
-                        'timestamp': timestamp.isoformat(),
+        ``readings`` holds ``(sensor_type, value, unit, timestamp)`` tuples in
+        arrival order; the device's tracked variables come from the cache
+        and all samples are written in one insert. Runs on the executor thread
+        and returns ``(widget_id, [encoded payloads])`` pairs to broadcast.
+        """
+        if not readings:
+            return []
+
+        tracked_vars = TrackedVariable.for_device(device_id)
+        if not tracked_vars:
+            return []
+
+        vars_by_type = defaultdict(list)
+        for tv in tracked_vars:
+            vars_by_type[tv['sensor_type']].append(tv)
+
+        samples = []
+        # tracked variable pk -> (tv, [encoded widget payloads in arrival order])
+        updates = {}
+        # tracked variable pk -> (value, unit) taken in this flush; only
+        # remembered for dedupe once the samples are actually written
+        taken_values = {}
+        for sensor_type, value, unit, timestamp in readings:
+            matching_vars = vars_by_type.get(sensor_type)
+            if not matching_vars:
+                continue
+
+            numeric_value = widget_payload = None
+            for tv in matching_vars:
+                # Unchanged reading – nothing new to store or show on the widget
+                previous = taken_values.get(tv['id'], self._last_widget_value.get(tv['id']))
+                if previous == (value, unit):
+                    continue
+                taken_values[tv['id']] = (value, unit)
+
+                # Every widget tracking this reading stores and receives the
+                # same thing, so convert and encode it once, and only when some
+                # widget actually takes the reading
+                if widget_payload is None:
+                    # Convert value to appropriate type for storage
+                    # WidgetSample expects a float value field, so we need to handle string sensors
+                    if isinstance(value, str):
+                        # For string sensors, we'll store 0.0 as the numeric value
+                        # and rely on the actual value being in the broadcast data
+                        numeric_value = 0.0
+                    else:
+                        try:
+                            numeric_value = float(value)
+                        except (ValueError, TypeError):
+                            numeric_value = 0.0
+                    widget_payload = orjson.dumps({
+                        'timestamp': timestamp,
                         'value': value,  # Use original value (string or numeric)
                         'unit': unit,
+                    }).decode()
+
+                samples.append(WidgetSample(
+                    widget_id=tv['id'],
+                    timestamp=timestamp,
+                    value=numeric_value,
+                    unit=unit,
+                ))
+                updates.setdefault(tv['id'], (tv, []))[1].append(widget_payload)
+
+        if not samples:
+            return []
+
+        # Save every widget sample from this message in a single write
+        WidgetSample.insert_samples(samples)
+        self._last_widget_value.update(taken_values)
+
+        # On PostgreSQL an AFTER INSERT trigger already trimmed the buffers
+        if not WidgetSample.pruned_by_database():
+            for tv, payloads in updates.values():
+                # Trim to max_samples – readers slice to max_samples anyway, so
+                # the buffer only needs pruning every TRIM_EVERY_SAMPLES inserts
+                _samples_since_trim[tv['id']] += len(payloads)
+                if _samples_since_trim[tv['id']] >= TRIM_EVERY_SAMPLES:
+                    _samples_since_trim[tv['id']] = 0
+                    self._trim_samples(tv['id'], tv['max_samples'])
+
+        return [(tv['widget_id'], payloads) for tv, payloads in updates.values()]
+
+    async def _broadcast_sensor_data(self, batch):
+        """Send a message's encoded readings to the dashboard group"""
+        # The whole message travels through the channel layer as a
+        # single group_send; receivers unpack it into frames.
+        if batch and await _has_viewers(self.channel_layer, self.room_group_name):
+            if len(batch) == 1:
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {'type': 'sensor_data_message', 'text': batch[0]}
+                )
+                return
+            # Very large messages are split so no single channel-layer
+            # message grows without bound. Chunks go out one after another:
+            # concurrent publishes may use different pooled connections and
+            # reach viewers out of order.
+            for start in range(0, len(batch), BROADCAST_CHUNK_SIZE):
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        'type': 'sensor_data_batch',
+                        'texts': batch[start:start + BROADCAST_CHUNK_SIZE],
                     }
-                }
-            )
+                )
+
+    async def _broadcast_widget_updates(self, widget_updates):
+        """Send the payloads produced by ``_store_widget_samples`` to widget groups"""
+        async def broadcast(widget_id, payloads):
+            # Broadcast to widget group - use original value in broadcast
+            widget_group = f"widget_{widget_id}"
+            if await _has_viewers(self.channel_layer, widget_group):
+                # One group_send per widget, however many readings it got
+                await self.channel_layer.group_send(
+                    widget_group,
+                    {
+                        'type': 'widget_update_batch',
+                        'texts': payloads,
+                    }
+                )
 
-    def _trim_samples(self, tv):
-        qs = WidgetSample.objects.filter(widget=tv).order_by('-timestamp')
-        excess = qs[tv.max_samples:]
-        if excess:
-            WidgetSample.objects.filter(id__in=[s.id for s in excess]).delete()
+        # Widgets are independent – overlap their channel-layer waits
+        await asyncio.gather(*(
+            broadcast(widget_id, payloads) for widget_id, payloads in widget_updates
+        ))
+
+    def _trim_samples(self, widget_pk, max_samples):
+        # Single DELETE ... WHERE id IN (SELECT ... OFFSET max_samples)
+        # Readings from one message share a timestamp; id breaks the tie
+        excess_ids = (
+            WidgetSample.objects.filter(widget_id=widget_pk)
+            .order_by('-timestamp', '-id')
+            .values('id')[max_samples:]
+        )
+        WidgetSample.objects.filter(widget_id=widget_pk, id__in=excess_ids).delete()
 
 # ---------------------------------------------------------------------------
 # Consumer for dashboard widgets (read-only, just receives updates)
@@ -352,23 +734,22 @@ class SensorDataConsumer(AsyncWebsocketConsumer):
 
 
 class WidgetDataConsumer(AsyncWebsocketConsumer):
+    viewer_registered = False
+
     async def connect(self):
-        logger.info(f"WidgetDataConsumer connect attempt: path={self.scope.get('path')} query={self.scope.get('query_string')} user={self.scope.get('user')}")
+        logger.debug(
+            "WidgetDataConsumer connect attempt: path=%s query=%s user=%s",
+            self.scope.get('path'), self.scope.get('query_string'), self.scope.get('user')
+        )
         
         # --- Authentication (same pattern as SensorDataConsumer) ---------
         # Check for JWT token in query params
-        query_params = urllib.parse.parse_qs(self.scope.get("query_string", b"").decode())
-        token_param = query_params.get("token", [None])[0]
+        token_param = _extract_token(self.scope.get("query_string", b""))
 
         if token_param:
             # Validate JWT token and set user in scope
             try:
-                UntypedToken(token_param)  # validates signature & expiry
-                from rest_framework_simplejwt.authentication import JWTAuthentication
-                jwt_auth = JWTAuthentication()
-                validated_token = jwt_auth.get_validated_token(token_param)
-                user = await database_sync_to_async(jwt_auth.get_user)(validated_token)
-                self.scope["user"] = user
+                self.scope["user"] = await _authenticate_jwt(token_param)
             except (InvalidToken, TokenError) as e:
                 logger.warning("Invalid JWT token provided for widget connection – rejecting")
                 await self.close(code=4001)
@@ -385,14 +766,24 @@ class WidgetDataConsumer(AsyncWebsocketConsumer):
         self.widget_id = self.scope['url_route']['kwargs']['widget_id']
         self.group_name = f'widget_{self.widget_id}'
 
-        await self.channel_layer.group_add(self.group_name, self.channel_name)
-        await self.accept()
+        await asyncio.gather(
+            self.channel_layer.group_add(self.group_name, self.channel_name),
+            self.accept(),
+            _add_viewer(self.group_name),
+        )
+        self.viewer_registered = True
         
-        logger.info(f"WidgetDataConsumer connection established for widget: {self.widget_id}, user: {user.username if user else 'Anonymous'}")
+        logger.info(
+            "WidgetDataConsumer connection established for widget: %s, user: %s",
+            self.widget_id, user.username if user else 'Anonymous'
+        )
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.group_name, self.channel_name)
-        logger.info(f"WidgetDataConsumer disconnected: widget={self.widget_id}, code={close_code}")
+        if self.viewer_registered:
+            await _remove_viewer(self.group_name)
+        logger.info("WidgetDataConsumer disconnected: widget=%s, code=%s", self.widget_id, close_code)
 
-    async def widget_update(self, event):
-        await self.send(text_data=json.dumps(event['payload']))
\ No newline at end of file
+    async def widget_update_batch(self, event):
+        for text in event['texts']:
+            await self.send(text_data=text)
\ No newline at end of file
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.5 on 2026-10-16 19:53
+
+import sensors.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0010_trackedvariable_widgetsample_and_more'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='widgetsample',
+            name='widget_samp_widget__907f9c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='widgetsample',
+            index=sensors.models.PortableCoveringIndex(fields=['widget', '-timestamp'], name='ws_widget_ts_covering', covering=('value', 'unit')),
+        ),
+    ]
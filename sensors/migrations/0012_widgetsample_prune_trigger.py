@@ -0,0 +1,61 @@
+from django.db import migrations
+
+
+# Statement-level so a multi-row insert (or COPY) prunes each touched widget
+# once, keeping the newest max_samples rows. id breaks timestamp ties because
+# readings from one message share a timestamp.
+CREATE_PRUNE_TRIGGER = """
+CREATE OR REPLACE FUNCTION prune_widget_samples() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM widget_samples ws
+    USING (
+        SELECT ranked.id
+        FROM (
+            SELECT id, widget_id,
+                   row_number() OVER (
+                       PARTITION BY widget_id ORDER BY timestamp DESC, id DESC
+                   ) AS rn
+            FROM widget_samples
+            WHERE widget_id IN (SELECT DISTINCT widget_id FROM inserted)
+        ) ranked
+        JOIN tracked_variables tv ON tv.id = ranked.widget_id
+        WHERE ranked.rn > tv.max_samples
+    ) excess
+    WHERE ws.id = excess.id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS widget_samples_prune ON widget_samples;
+CREATE TRIGGER widget_samples_prune
+    AFTER INSERT ON widget_samples
+    REFERENCING NEW TABLE AS inserted
+    FOR EACH STATEMENT EXECUTE FUNCTION prune_widget_samples();
+"""
+
+DROP_PRUNE_TRIGGER = """
+DROP TRIGGER IF EXISTS widget_samples_prune ON widget_samples;
+DROP FUNCTION IF EXISTS prune_widget_samples();
+"""
+
+
+def create_prune_trigger(apps, schema_editor):
+    # Other backends keep pruning in the consumer
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(CREATE_PRUNE_TRIGGER)
+
+
+def drop_prune_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(DROP_PRUNE_TRIGGER)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0011_widgetsample_covering_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prune_trigger, drop_prune_trigger),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-16 19:55
+
+import sensors.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0012_widgetsample_prune_trigger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sensordata',
+            name='raw_data',
+            field=models.JSONField(blank=True, encoder=sensors.models.OrjsonEncoder, help_text='Original JSON data from ESP32', null=True),
+        ),
+    ]
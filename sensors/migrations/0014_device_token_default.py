@@ -0,0 +1,19 @@
+# Generated by Django 5.1.5 on 2026-10-16 19:58
+
+import sensors.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0013_sensordata_raw_data_orjson'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='device',
+            name='token',
+            field=models.CharField(default=sensors.models.generate_device_token, help_text='Unique authentication token for device', max_length=255, unique=True),
+        ),
+    ]
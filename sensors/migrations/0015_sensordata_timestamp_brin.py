@@ -0,0 +1,18 @@
+# Generated by Django 5.1.5 on 2026-10-16 19:59
+
+import sensors.models
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0014_device_token_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensordata',
+            index=sensors.models.PortableBrinIndex(fields=['timestamp'], name='sensor_data_ts_brin', pages_per_range=32),
+        ),
+    ]
@@ -1,9 +1,141 @@
-from django.db import models
+from django.db import models, connections, router
+from django.contrib.postgres.indexes import BrinIndex
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
+from django.utils.functional import cached_property
+from functools import lru_cache
+import copy
+import csv
+import io
 import json
+import logging
 import uuid
 import secrets
+import orjson
+
+logger = logging.getLogger(__name__)
+
+
+def _copy_rows(connection, table, columns, rows):
+    """Stream ``rows`` into ``table`` with PostgreSQL COPY FROM STDIN"""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy'):
+            # psycopg 3
+            with raw_cursor.copy(sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:
+            # psycopg2
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            raw_cursor.copy_expert(f"{sql} WITH CSV", buffer)
+
+
+class OrjsonEncoder(DjangoJSONEncoder):
+    """JSONField encoder that serializes with orjson.
+
+    Anything orjson rejects (e.g. non-str keys) falls back to the stdlib
+    encoder so payloads that saved before still save.
+    """
+
+    def encode(self, o):
+        try:
+            return orjson.dumps(o, default=self.default, option=orjson.OPT_NAIVE_UTC).decode()
+        except TypeError:
+            return super().encode(o)
+
+
+class DeviceQuerySet(models.QuerySet):
+    def with_project_counts(self):
+        """Annotate ``project_count`` so listings don't run a COUNT per device.
+
+        Annotate before filtering on ``projects`` so the filter's join does
+        not narrow the count.
+        """
+        return self.annotate(project_count=models.Count('projects', distinct=True))
+
+
+class MqttClusterManager(models.Manager):
+    """Leaves the password column out unless a caller asks for it.
+
+    Only the broker connection test reads it, so listings and lookups skip
+    the column entirely.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().defer('password')
+
+    def with_password(self):
+        return super().get_queryset()
+
+
+class PortableBrinIndex(BrinIndex):
+    """BRIN index on PostgreSQL, a regular B-tree index on other backends.
+
+    Lets append-only tables declare a BRIN index while development keeps
+    running on sqlite.
+    """
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return models.Index.create_sql(self, model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
+class PortableCoveringIndex(models.Index):
+    """Index with INCLUDE columns on PostgreSQL, a plain index elsewhere.
+
+    Takes the non-key columns as ``covering`` rather than ``include`` so
+    backends without covering indexes (sqlite, MySQL) don't raise
+    models.W040 on every check and migrate.
+    """
+
+    def __init__(self, *args, covering=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.covering = tuple(covering)
+
+    def deconstruct(self):
+        path, args, kwargs = super().deconstruct()
+        kwargs['covering'] = self.covering
+        return path, args, kwargs
+
+    def create_sql(self, model, schema_editor, using="", **kwargs):
+        if schema_editor.connection.vendor == 'postgresql':
+            index = copy.copy(self)
+            index.include = self.covering
+            return models.Index.create_sql(index, model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
+# Sensor types that have string values
+STRING_VALUE_SENSORS = (
+    'location', 'gps', 'coordinates', 'address', 'place',
+    'personal_id', 'user_id', 'device_id', 'identity',
+    'camera', 'image', 'video', 'audio', 'text',
+    'status', 'state', 'mode', 'alert', 'message'
+)
+
+
+@lru_cache(maxsize=1024)
+def _is_string_value_sensor(sensor_type):
+    """Whether ``sensor_type`` names a string-valued sensor (memoized per type)"""
+    sensor_type = sensor_type.lower()
+    return any(sensor in sensor_type for sensor in STRING_VALUE_SENSORS)
+
+
+@lru_cache(maxsize=4096)
+def _connection_url(use_ssl, username, host, port):
+    """Masked MQTT connection URL (memoized per connection settings)"""
+    protocol = 'mqtts' if use_ssl else 'mqtt'
+    if username:
+        return f"{protocol}://{username}:***@{host}:{port}"
+    return f"{protocol}://{host}:{port}"
+
 
 class SensorData(models.Model):
     """Model to store sensor data received from ESP32 devices"""
@@ -13,42 +145,58 @@ class SensorData(models.Model):
     value = models.FloatField(help_text="Sensor reading value")
     unit = models.CharField(max_length=20, blank=True, help_text="Unit of measurement")
     timestamp = models.DateTimeField(default=timezone.now, help_text="When the data was received")
-    raw_data = models.JSONField(blank=True, null=True, help_text="Original JSON data from ESP32")
+    raw_data = models.JSONField(blank=True, null=True, encoder=OrjsonEncoder, help_text="Original JSON data from ESP32")
     
     class Meta:
         ordering = ['-timestamp']
         indexes = [
             models.Index(fields=['device_id', '-timestamp']),
             models.Index(fields=['sensor_type', '-timestamp']),
+            # Cross-device time-range scans; rows arrive in timestamp order
+            PortableBrinIndex(fields=['timestamp'], pages_per_range=32, name='sensor_data_ts_brin'),
         ]
     
     def __str__(self):
         return f"{self.device_id} - {self.sensor_type}: {self.value} {self.unit} at {self.timestamp}"
     
     @classmethod
-    def create_from_esp32_data(cls, data):
-        """Create SensorData instance from ESP32 JSON data"""
+    def create_from_esp32_data(cls, data, timestamp=None):
+        """Create SensorData instance from ESP32 JSON data
+
+        ``timestamp`` lets callers stamp several readings from one message
+        with the same receive time; it defaults to now.
+        """
+        instance = cls.from_esp32_data(data, timestamp=timestamp)
+        instance.save(force_insert=True)
+        return instance
+
+    @classmethod
+    def bulk_create_from_esp32_data(cls, readings, timestamp=None):
+        """Create SensorData rows for several ESP32 readings with one INSERT"""
+        return cls.objects.bulk_create(
+            [cls.from_esp32_data(data, timestamp=timestamp) for data in readings],
+            batch_size=500,
+        )
+
+    @classmethod
+    def from_esp32_data(cls, data, timestamp=None):
+        """Build an unsaved SensorData instance from ESP32 JSON data"""
         try:
-            if isinstance(data, str):
-                data = json.loads(data)
+            if isinstance(data, (str, bytes)):
+                data = orjson.loads(data)
             
             # Handle different value types based on sensor type
             raw_value = data.get('value', 0)
-            sensor_type = data.get('sensor_type', 'unknown').lower()
-            
-            # Define sensor types that have string values
-            string_value_sensors = [
-                'location', 'gps', 'coordinates', 'address', 'place',
-                'personal_id', 'user_id', 'device_id', 'identity',
-                'camera', 'image', 'video', 'audio', 'text',
-                'status', 'state', 'mode', 'alert', 'message'
-            ]
+            sensor_type = data.get('sensor_type', 'unknown')
             
             # Try to convert to float, but handle string values gracefully
-            if any(sensor in sensor_type for sensor in string_value_sensors):
+            if _is_string_value_sensor(sensor_type):
                 # For string-type sensors, store as 0.0 in the float field
                 # and preserve the actual value in raw_data
                 numeric_value = 0.0
+            elif type(raw_value) is float:
+                # Already a float from the JSON parser
+                numeric_value = raw_value
             else:
                 # For numeric sensors, convert to float
                 try:
@@ -56,21 +204,25 @@ class SensorData(models.Model):
                 except (ValueError, TypeError):
                     # If conversion fails, store as 0.0 and log the issue
                     numeric_value = 0.0
-                    import logging
-                    logger = logging.getLogger(__name__)
-                    logger.warning(f"Could not convert sensor value to float: {raw_value} for sensor {sensor_type}")
+                    logger.warning("Could not convert sensor value to float: %s for sensor %s", raw_value, sensor_type)
             
-            return cls.objects.create(
+            return cls(
                 device_id=data.get('device_id', 'unknown'),
-                sensor_type=data.get('sensor_type', 'unknown'),
+                sensor_type=sensor_type,
                 value=numeric_value,
                 unit=data.get('unit', ''),
+                timestamp=timestamp or timezone.now(),
                 raw_data=data
             )
-        except (json.JSONDecodeError) as e:
+        except (json.JSONDecodeError) as e:  # orjson.JSONDecodeError subclasses it
             raise ValueError(f"Invalid sensor data format: {e}")
 
 
+def generate_device_token():
+    """Default for Device.token; URL-safe since devices pass it in the query string"""
+    return secrets.token_urlsafe(32)
+
+
 class Device(models.Model):
     """Model to store IoT device information with project assignment capabilities"""
     
@@ -89,7 +241,7 @@ class Device(models.Model):
     description = models.TextField(blank=True, help_text="Device description")
     
     # Authentication token for device API access
-    token = models.CharField(max_length=255, unique=True, help_text="Unique authentication token for device")
+    token = models.CharField(max_length=255, unique=True, default=generate_device_token, help_text="Unique authentication token for device")
     
     # Relationships
     organization = models.ForeignKey(
@@ -115,6 +267,8 @@ class Device(models.Model):
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = DeviceQuerySet.as_manager()
+    
     class Meta:
         db_table = 'devices'
         # Ensure unique device names per organization
@@ -131,10 +285,6 @@ class Device(models.Model):
         ]
     
     def save(self, *args, **kwargs):
-        # Generate token if not set
-        if not self.token:
-            self.token = secrets.token_urlsafe(32)
-        
         # Set legacy user field to creator for backward compatibility
         if not self.user_id:
             self.user = self.creator
@@ -146,6 +296,8 @@ class Device(models.Model):
     
     def get_project_count(self):
         """Get number of projects this device is assigned to"""
+        if 'project_count' in self.__dict__:
+            return self.project_count
         return self.projects.count()
     
     def assign_to_project(self, project):
@@ -199,6 +351,8 @@ class MqttCluster(models.Model):
     total_messages = models.BigIntegerField(default=0, help_text="Total messages published")
     total_subscriptions = models.IntegerField(default=0, help_text="Number of active subscriptions")
     
+    objects = MqttClusterManager()
+    
     class Meta:
         db_table = 'mqtt_clusters'
         indexes = [
@@ -210,13 +364,21 @@ class MqttCluster(models.Model):
     def __str__(self):
         return f"{self.name} ({self.cluster_type})"
     
-    @property
-    def connection_url(self):
+    def save(self, *args, **kwargs):
+        # Host/port/credentials may have changed; rebuild the URLs on next access
+        self.__dict__.pop('connection_url', None)
+        self.__dict__.pop('broker_url', None)
+        super().save(*args, **kwargs)
+    
+    @cached_property
+    def connection_url(self) -> str:
         """Generate MQTT connection URL"""
-        protocol = 'mqtts' if self.use_ssl else 'mqtt'
-        if self.username:
-            return f"{protocol}://{self.username}:***@{self.host}:{self.port}"
-        return f"{protocol}://{self.host}:{self.port}"
+        return _connection_url(self.use_ssl, self.username, self.host, self.port)
+    
+    @cached_property
+    def broker_url(self) -> str:
+        """MQTT connection URL without credentials, as returned by the API"""
+        return _connection_url(self.use_ssl, '', self.host, self.port)
 
 
 class MqttTopic(models.Model):
@@ -294,6 +456,11 @@ class TrackedVariable(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Per-device lists read on every ingest flush; sensors.signals clears a
+    # device's entry whenever one of its tracked variables is saved or deleted
+    CACHE_KEY = 'tv:{}'
+    CACHE_TTL = 60
+
     class Meta:
         db_table = 'tracked_variables'
         unique_together = [('device_id', 'sensor_type', 'widget_id')]
@@ -305,6 +472,23 @@ class TrackedVariable(models.Model):
     def __str__(self):
         return f"{self.device_id}:{self.sensor_type} → widget {self.widget_id}"
 
+    @classmethod
+    def for_device(cls, device_id):
+        """Tracked variables of ``device_id`` as dicts, cached for CACHE_TTL seconds.
+
+        Devices without any are cached too, so untracked telemetry costs a
+        cache hit rather than a query.
+        """
+        cache_key = cls.CACHE_KEY.format(device_id)
+        tracked_vars = cache.get(cache_key)
+        if tracked_vars is None:
+            tracked_vars = list(
+                cls.objects.filter(device_id=device_id)
+                .values('id', 'widget_id', 'max_samples', 'sensor_type')
+            )
+            cache.set(cache_key, tracked_vars, cls.CACHE_TTL)
+        return tracked_vars
+
 
 class WidgetSample(models.Model):
     """Circular-buffer sample for a widget (max 50 rows per tracked variable)."""
@@ -322,10 +506,41 @@ class WidgetSample(models.Model):
         ordering = ['-timestamp']
         db_table = 'widget_samples'
         indexes = [
-            models.Index(fields=['widget', '-timestamp']),
+            # Chart tails are read newest-first per widget; on PostgreSQL the
+            # INCLUDE columns make that an index-only scan. Other backends
+            # build the same index without them.
+            PortableCoveringIndex(
+                fields=['widget', '-timestamp'],
+                covering=['value', 'unit'],
+                name='ws_widget_ts_covering',
+            ),
         ]
 
     def __str__(self):
         return f"{self.widget.widget_id} @ {self.timestamp}: {self.value}{self.unit}"
 
+    COPY_COLUMNS = ('widget_id', 'timestamp', 'value', 'unit')
+
+    @classmethod
+    def pruned_by_database(cls):
+        """True when the prune_widget_samples trigger (PostgreSQL) trims buffers."""
+        return connections[router.db_for_write(cls)].vendor == 'postgresql'
+
+    @classmethod
+    def insert_samples(cls, samples):
+        """Insert unsaved WidgetSample instances in a single round trip.
+
+        PostgreSQL streams the rows with COPY, skipping INSERT parsing
+        entirely; other backends fall back to ``bulk_create``.
+        """
+        if not samples:
+            return
+        connection = connections[router.db_for_write(cls)]
+        if connection.vendor != 'postgresql':
+            cls.objects.bulk_create(samples)
+            return
+
+        rows = [(s.widget_id, s.timestamp, s.value, s.unit) for s in samples]
+        _copy_rows(connection, cls._meta.db_table, cls.COPY_COLUMNS, rows)
+
 
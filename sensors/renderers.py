@@ -0,0 +1,46 @@
+"""
+orjson-backed DRF renderer and parser, used as the project defaults
+"""
+
+import orjson
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+# DRF's fallbacks (Decimal, timedelta, QuerySet, lazy strings, ...) for the
+# types orjson doesn't encode natively
+_drf_default = JSONEncoder().default
+
+
+class OrjsonRenderer(JSONRenderer):
+    """JSONRenderer that encodes with orjson.
+
+    Output matches DRF's compact encoder: UTC datetimes end in 'Z' and
+    anything orjson can't encode natively goes through DRF's own fallback.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return orjson.dumps(
+            data,
+            default=_drf_default,
+            option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS,
+        )
+
+
+class OrjsonParser(JSONParser):
+    """JSONParser that decodes request bodies with orjson"""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                body = body.decode(encoding)
+            return orjson.loads(body)
+        except (ValueError, UnicodeDecodeError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
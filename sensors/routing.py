@@ -1,9 +1,12 @@
-from django.urls import re_path
+from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
-    # Accepts 'ws/sensors/' or '/ws/sensors/' (Channels passes path without leading slash)
-    re_path(r'^/?ws/sensors/?$', consumers.SensorDataConsumer.as_asgi()),
+    # URLRouter strips the leading slash, so '/ws/sensors/' matches as well;
+    # firmware may also connect without the trailing slash
+    path('ws/sensors/', consumers.SensorDataConsumer.as_asgi()),
+    path('ws/sensors', consumers.SensorDataConsumer.as_asgi()),
     # Widget live-data stream
-    re_path(r'^/?ws/widgets/(?P<widget_id>[^/]+)/?$', consumers.WidgetDataConsumer.as_asgi()),
-] 
\ No newline at end of file
+    path('ws/widgets/<str:widget_id>/', consumers.WidgetDataConsumer.as_asgi()),
+    path('ws/widgets/<str:widget_id>', consumers.WidgetDataConsumer.as_asgi()),
+]
\ No newline at end of file
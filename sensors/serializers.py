@@ -1,6 +1,13 @@
+import re
+import secrets
+from django.db.models import Prefetch
 from rest_framework import serializers
 from .models import SensorData, Device, MqttCluster, MqttTopic, MqttActivity
-from typing import List, Dict, Any
+from user.models import Project
+from user.serializers import ProjectListSerializer
+
+# Letters, digits and underscores, with at least one letter or digit
+MQTT_USERNAME_RE = re.compile(r'(?=.*[A-Za-z0-9])[A-Za-z0-9_]+')
 
 class SensorDataSerializer(serializers.ModelSerializer):
     """Serializer for SensorData model"""
@@ -9,12 +16,14 @@ class SensorDataSerializer(serializers.ModelSerializer):
         model = SensorData
         fields = ['id', 'device_id', 'sensor_type', 'value', 'unit', 'timestamp', 'raw_data']
         read_only_fields = ['id', 'timestamp']
+        extra_kwargs = {'timestamp': {'format': None}}
 
 
 class DeviceListSerializer(serializers.ModelSerializer):
     """Simplified serializer for device listing"""
     
-    project_count = serializers.SerializerMethodField()
+    # Annotated by DeviceViewSet.get_queryset (DeviceQuerySet.with_project_counts)
+    project_count = serializers.IntegerField(read_only=True)
     organization_name = serializers.CharField(source='organization.name', read_only=True)
     creator_name = serializers.CharField(source='creator.username', read_only=True)
     
@@ -26,18 +35,23 @@ class DeviceListSerializer(serializers.ModelSerializer):
             'is_active', 'created_at', 'updated_at'
         ]
         read_only_fields = ['uuid', 'created_at', 'updated_at']
-    
-    def get_project_count(self, obj):
-        return obj.get_project_count()
+        # Raw datetimes; the orjson renderer formats them
+        extra_kwargs = {
+            'last_seen': {'format': None},
+            'created_at': {'format': None},
+            'updated_at': {'format': None},
+        }
 
 
 class DeviceSerializer(serializers.ModelSerializer):
     """Full serializer for Device model with project relations"""
     
-    project_count = serializers.SerializerMethodField()
+    # Annotated by DeviceViewSet.get_queryset (DeviceQuerySet.with_project_counts)
+    project_count = serializers.IntegerField(read_only=True)
     organization_name = serializers.CharField(source='organization.name', read_only=True)
     creator_name = serializers.CharField(source='creator.username', read_only=True)
-    assigned_projects = serializers.SerializerMethodField()
+    # Reads the projects the viewset prefetched for retrieve
+    assigned_projects = ProjectListSerializer(source='projects', many=True, read_only=True)
     token = serializers.CharField(read_only=True)  # Token is read-only for security
     
     class Meta:
@@ -49,13 +63,11 @@ class DeviceSerializer(serializers.ModelSerializer):
             'created_at', 'updated_at'
         ]
         read_only_fields = ['uuid', 'token', 'creator', 'created_at', 'updated_at']
-    
-    def get_project_count(self, obj):
-        return obj.get_project_count()
-    
-    def get_assigned_projects(self, obj):
-        from user.serializers import ProjectListSerializer
-        return ProjectListSerializer(obj.projects.all(), many=True).data
+        extra_kwargs = {
+            'last_seen': {'format': None},
+            'created_at': {'format': None},
+            'updated_at': {'format': None},
+        }
     
     def create(self, validated_data):
         # Set creator from request context
@@ -84,9 +96,6 @@ class DeviceCreateSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         """Create a device ensuring a unique, immutable authentication token."""
-        import secrets
-        from sensors.models import Device
-
         project_uuids = validated_data.pop('project_uuids', [])
 
         # Attach creator (required field)
@@ -102,14 +111,18 @@ class DeviceCreateSerializer(serializers.ModelSerializer):
         # Persist device with the pre-generated token
         device = super().create(validated_data)
 
-        # Assign to projects if specified
+        # Assign to projects if specified; a new device has no existing
+        # links, so insert the through rows directly instead of set()
         if project_uuids:
-            from user.models import Project
-            projects = Project.objects.filter(
+            project_ids = Project.objects.filter(
                 uuid__in=project_uuids,
                 organization=device.organization
-            )
-            device.projects.set(projects)
+            ).values_list('id', flat=True)
+            Through = Device.projects.through
+            Through.objects.bulk_create([
+                Through(device_id=device.id, project_id=project_id)
+                for project_id in project_ids
+            ])
 
         return device
 
@@ -128,8 +141,6 @@ class DeviceProjectAssignmentSerializer(serializers.Serializer):
     project_uuid = serializers.UUIDField()
     
     def validate_project_uuid(self, value):
-        from user.models import Project
-        
         device = self.context.get('device')
         if not device:
             raise serializers.ValidationError("Device context not provided")
@@ -141,6 +152,30 @@ class DeviceProjectAssignmentSerializer(serializers.Serializer):
             raise serializers.ValidationError("Project not found in the same organization")
 
 
+class DeviceProjectBulkAssignmentSerializer(serializers.Serializer):
+    """Serializer for assigning a device to several projects at once"""
+    
+    project_uuids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+    
+    def validate(self, attrs):
+        device = self.context.get('device')
+        if not device:
+            raise serializers.ValidationError("Device context not provided")
+        
+        # Resolve the whole batch with one query
+        project_uuids = set(attrs['project_uuids'])
+        projects = list(Project.objects.filter(uuid__in=project_uuids, organization=device.organization))
+        missing = project_uuids - {project.uuid for project in projects}
+        if missing:
+            raise serializers.ValidationError({
+                'project_uuids': "Projects not found in the same organization: "
+                                 + ", ".join(sorted(str(project_uuid) for project_uuid in missing))
+            })
+        
+        attrs['projects'] = projects
+        return attrs
+
+
 class MqttTopicSerializer(serializers.ModelSerializer):
     """Serializer for MQTT Topic model"""
     
@@ -148,6 +183,21 @@ class MqttTopicSerializer(serializers.ModelSerializer):
         model = MqttTopic
         fields = ['id', 'topic_name', 'message_count', 'last_message_at', 'created_at', 'is_active']
         read_only_fields = ['id', 'created_at']
+        extra_kwargs = {
+            'last_message_at': {'format': None},
+            'created_at': {'format': None},
+        }
+    
+    def to_representation(self, instance):
+        # Paged per cluster; plain columns, so no per-field dispatch
+        return {
+            'id': instance.id,
+            'topic_name': instance.topic_name,
+            'message_count': instance.message_count,
+            'last_message_at': instance.last_message_at,
+            'created_at': instance.created_at,
+            'is_active': instance.is_active,
+        }
 
 
 class MqttActivitySerializer(serializers.ModelSerializer):
@@ -157,6 +207,18 @@ class MqttActivitySerializer(serializers.ModelSerializer):
         model = MqttActivity
         fields = ['id', 'activity_type', 'topic_name', 'client_id', 'message_size', 'timestamp']
         read_only_fields = ['id', 'timestamp']
+        extra_kwargs = {'timestamp': {'format': None}}
+    
+    def to_representation(self, instance):
+        # Nested under every cluster; plain columns, so no per-field dispatch
+        return {
+            'id': instance.id,
+            'activity_type': instance.activity_type,
+            'topic_name': instance.topic_name,
+            'client_id': instance.client_id,
+            'message_size': instance.message_size,
+            'timestamp': instance.timestamp,
+        }
 
 
 # New serializers for ACL and Device operations
@@ -164,13 +226,15 @@ class ACLSerializer(serializers.Serializer):
     """Serializer for MQTT ACL operations"""
     id = serializers.CharField(read_only=True)
     topicPattern = serializers.CharField(max_length=255)
-    accessType = serializers.IntegerField(min_value=1, max_value=4)
-    
-    def validate_accessType(self, value):
-        """Validate access type values"""
-        if value not in [1, 2, 3, 4]:  # 1=read, 2=write, 3=read/write, 4=subscribe
-            raise serializers.ValidationError("Access type must be 1(read), 2(write), 3(read/write), or 4(subscribe)")
-        return value
+    # 1=read, 2=write, 3=read/write, 4=subscribe; the range check is the validation
+    accessType = serializers.IntegerField(
+        min_value=1,
+        max_value=4,
+        error_messages={
+            'min_value': "Access type must be 1(read), 2(write), 3(read/write), or 4(subscribe)",
+            'max_value': "Access type must be 1(read), 2(write), 3(read/write), or 4(subscribe)",
+        },
+    )
 
 
 class MqttPasswordSerializer(serializers.Serializer):
@@ -180,7 +244,7 @@ class MqttPasswordSerializer(serializers.Serializer):
     
     def validate_username(self, value):
         """Validate username format"""
-        if not value.replace('_', '').isalnum():
+        if not MQTT_USERNAME_RE.fullmatch(value):
             raise serializers.ValidationError("Username can only contain letters, numbers, and underscores")
         return value
 
@@ -188,10 +252,10 @@ class MqttPasswordSerializer(serializers.Serializer):
 class MqttClusterSerializer(serializers.ModelSerializer):
     """Serializer for MQTT Cluster model"""
     
-    # Nested relations
-    topics = MqttTopicSerializer(many=True, read_only=True)
-    recent_activities = serializers.SerializerMethodField()
-    connection_url = serializers.SerializerMethodField()
+    # Nested relations – topics are paged at mqtt-clusters/<uuid>/topics/ instead;
+    # recent_activity_list is filled by recent_activities_prefetch()
+    recent_activities = MqttActivitySerializer(source='recent_activity_list', many=True, read_only=True)
+    connection_url = serializers.ReadOnlyField(source='broker_url')
     
     class Meta:
         model = MqttCluster
@@ -199,33 +263,40 @@ class MqttClusterSerializer(serializers.ModelSerializer):
             'uuid', 'name', 'cluster_type', 'host', 'port', 'use_ssl',
             'username', 'description', 'is_active', 'created_at', 'updated_at',
             'total_topics', 'total_messages', 'total_subscriptions',
-            'connection_url', 'topics', 'recent_activities'
+            'connection_url', 'recent_activities'
         ]
         read_only_fields = ['uuid', 'created_at', 'updated_at', 'connection_url']
         extra_kwargs = {
-            'password': {'write_only': True}  # Never return password in API
+            'password': {'write_only': True},  # Never return password in API
+            'created_at': {'format': None},
+            'updated_at': {'format': None},
         }
     
-    def get_recent_activities(self, obj) -> List[Dict[str, Any]]:
-        """Get recent activities for this cluster"""
-        recent = obj.activities.order_by('-timestamp')[:10]
-        return MqttActivitySerializer(recent, many=True).data
+    RECENT_ACTIVITY_LIMIT = 10
     
-    def get_connection_url(self, obj) -> str:
-        """Get the connection URL for this cluster"""
-        protocol = "mqtts" if obj.use_ssl else "mqtt"
-        return f"{protocol}://{obj.host}:{obj.port}"
+    @classmethod
+    def recent_activities_prefetch(cls):
+        """Prefetch the newest activities per cluster in one windowed query"""
+        queryset = MqttActivity.objects.order_by('-timestamp')
+        return Prefetch(
+            'activities',
+            queryset=queryset[:cls.RECENT_ACTIVITY_LIMIT],
+            to_attr='recent_activity_list',
+        )
     
     def create(self, validated_data):
         # Set user from request context
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
+        cluster = super().create(validated_data)
+        # A new cluster has no activity yet
+        cluster.recent_activity_list = []
+        return cluster
 
 
 class MqttClusterListSerializer(serializers.ModelSerializer):
     """Simplified serializer for cluster listing"""
     
-    connection_url = serializers.SerializerMethodField()
+    connection_url = serializers.ReadOnlyField(source='broker_url')
     
     class Meta:
         model = MqttCluster
@@ -236,8 +307,24 @@ class MqttClusterListSerializer(serializers.ModelSerializer):
             'connection_url'
         ]
         read_only_fields = ['uuid', 'created_at', 'connection_url']
+        extra_kwargs = {'created_at': {'format': None}}
     
-    def get_connection_url(self, obj) -> str:
-        """Get the connection URL for this cluster"""
-        protocol = "mqtts" if obj.use_ssl else "mqtt"
-        return f"{protocol}://{obj.host}:{obj.port}"
\ No newline at end of file
+    def to_representation(self, instance):
+        # List rows are plain columns plus the cached URL; the orjson
+        # renderer formats the UUID and datetime natively
+        return {
+            'uuid': instance.uuid,
+            'name': instance.name,
+            'cluster_type': instance.cluster_type,
+            'host': instance.host,
+            'port': instance.port,
+            'use_ssl': instance.use_ssl,
+            'username': instance.username,
+            'description': instance.description,
+            'is_active': instance.is_active,
+            'created_at': instance.created_at,
+            'total_topics': instance.total_topics,
+            'total_messages': instance.total_messages,
+            'total_subscriptions': instance.total_subscriptions,
+            'connection_url': instance.broker_url,
+        }
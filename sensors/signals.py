@@ -0,0 +1,10 @@
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import TrackedVariable
+
+
+@receiver([post_save, post_delete], sender=TrackedVariable)
+def forget_tracked_variables(sender, instance, **kwargs):
+    """Drop the device's cached tracked variables so ingest sees the change"""
+    cache.delete(TrackedVariable.CACHE_KEY.format(instance.device_id))
@@ -1,3 +1,498 @@
-from django.test import TestCase
+import asyncio
+import base64
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import orjson
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from user.models import Organization, OrganizationMember, Project
+from . import consumers
+from .models import (
+    Device, MqttActivity, MqttCluster, MqttTopic, SensorData, TrackedVariable, WidgetSample,
+)
+from .renderers import OrjsonRenderer
+from .serializers import (
+    MqttActivitySerializer, MqttClusterListSerializer, MqttPasswordSerializer, MqttTopicSerializer,
+)
+from .routing import websocket_urlpatterns
+from .utils.device_encryption import device_encryption_manager
+
+
+application = URLRouter(websocket_urlpatterns)
+
+
+class ConsumerTestCase(TransactionTestCase):
+    """Base for websocket tests; resets the consumers' per-process caches."""
+
+    def setUp(self):
+        cache.clear()
+        for per_process in (
+            consumers._jwt_cache,
+            consumers._device_by_token,
+            consumers._unknown_device_tokens,
+            consumers._device_info_cache,
+            consumers._viewer_counts,
+            consumers._samples_since_trim,
+        ):
+            per_process.clear()
+
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.organization = Organization.objects.create(name='Acme', slug='acme', owner=self.user)
+        self.device = Device.objects.create(
+            name='esp32', organization=self.organization, creator=self.user
+        )
+        self.device_uuid = str(self.device.uuid)
+        self.jwt = str(AccessToken.for_user(self.user))
+
+    async def connect(self, path):
+        communicator = WebsocketCommunicator(application, path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected, path)
+        return communicator
+
+    async def connect_device(self):
+        device = await self.connect(f'/ws/sensors/?token={self.device.token}')
+        device_info = orjson.loads(await device.receive_from())
+        self.assertEqual(device_info['type'], 'device_info')
+        self.assertEqual(device_info['device_uuid'], self.device_uuid)
+        return device, device_info
+
+    async def send_reading(self, device, payload):
+        await device.send_to(text_data=orjson.dumps(payload).decode())
+        return orjson.loads(await device.receive_from())
+
+
+class SensorDataConsumerTests(ConsumerTestCase):
+
+    async def test_single_reading_is_saved_and_broadcast(self):
+        viewer = await self.connect(f'/ws/sensors/?token={self.jwt}')
+        device, _ = await self.connect_device()
+
+        ack = await self.send_reading(device, {
+            'device_id': 'ignored', 'sensor_type': 'temperature', 'value': 21.5, 'unit': 'C',
+        })
+        self.assertEqual(ack['status'], 'success')
+
+        frame = orjson.loads(await viewer.receive_from())
+        self.assertEqual(frame['type'], 'sensor_data')
+        # The authenticated device's uuid replaces whatever the payload claimed
+        self.assertEqual(frame['device_id'], self.device_uuid)
+        self.assertEqual(frame['value'], 21.5)
+        self.assertEqual(frame['id'], ack['id'])
+
+        row = await database_sync_to_async(SensorData.objects.get)(id=ack['id'])
+        self.assertEqual((row.device_id, row.sensor_type, row.value, row.unit),
+                         (self.device_uuid, 'temperature', 21.5, 'C'))
+        await viewer.disconnect()
+        await device.disconnect()
+
+    async def test_bulk_readings_share_one_timestamp(self):
+        viewer = await self.connect(f'/ws/sensors/?token={self.jwt}')
+        device, _ = await self.connect_device()
+
+        ack = await self.send_reading(device, {'readings': [
+            {'sensor_type': 'temperature', 'value': 20, 'unit': 'C'},
+            {'type': 'humidity', 'value': 55},
+            {'sensor_type': 'gps', 'value': '12.9,77.6'},
+            {'sensor_type': 'broken'},  # no value, skipped
+        ]})
+        self.assertEqual(ack['message'], '3 readings received and saved')
+
+        frames = [orjson.loads(await viewer.receive_from()) for _ in range(3)]
+        self.assertEqual([f['sensor_type'] for f in frames], ['temperature', 'humidity', 'gps'])
+        # String sensors are broadcast with their original value
+        self.assertEqual(frames[2]['value'], '12.9,77.6')
+        self.assertEqual(len({f['timestamp'] for f in frames}), 1)
+        self.assertTrue(await viewer.receive_nothing())
+
+        count = await database_sync_to_async(
+            SensorData.objects.filter(device_id=self.device_uuid).count
+        )()
+        self.assertEqual(count, 3)
+        await viewer.disconnect()
+        await device.disconnect()
+
+    async def test_chunked_broadcast_keeps_reading_order(self):
+        viewer = await self.connect(f'/ws/sensors/?token={self.jwt}')
+        device, _ = await self.connect_device()
+
+        with mock.patch.object(consumers, 'BROADCAST_CHUNK_SIZE', 2):
+            await self.send_reading(device, {'readings': [
+                {'sensor_type': f'probe{i}', 'value': i} for i in range(5)
+            ]})
+
+        frames = [orjson.loads(await viewer.receive_from()) for _ in range(5)]
+        self.assertEqual([f['value'] for f in frames], [0, 1, 2, 3, 4])
+        await viewer.disconnect()
+        await device.disconnect()
+
+    async def test_shorthand_readings(self):
+        device, _ = await self.connect_device()
+
+        ack = await self.send_reading(device, {'readings': {'temperature': 30, 'humidity': 50}})
+        self.assertEqual(ack['message'], '2 readings received and saved')
+
+        rows = await database_sync_to_async(lambda: sorted(
+            SensorData.objects.values_list('sensor_type', 'value', 'unit')
+        ))()
+        self.assertEqual(rows, [('humidity', 50.0, ''), ('temperature', 30.0, '')])
+        await device.disconnect()
+
+    async def test_encrypted_reading_is_decrypted_before_saving(self):
+        device, device_info = await self.connect_device()
+        self.assertTrue(device_info['encryption_enabled'])
+        key = base64.b64decode(device_info['encryption_key'])
+
+        payload = device_encryption_manager.encrypt_sensor_values({
+            'device_id': self.device_uuid, 'sensor_type': 'pressure', 'value': 1013.5, 'unit': 'hPa',
+        }, key)
+        ack = await self.send_reading(device, payload)
+        self.assertEqual(ack['status'], 'success')
+
+        row = await database_sync_to_async(SensorData.objects.get)(id=ack['id'])
+        self.assertEqual((row.sensor_type, row.value), ('pressure', 1013.5))
+        await device.disconnect()
+
+    async def test_invalid_json_is_reported(self):
+        device, _ = await self.connect_device()
+
+        await device.send_to(text_data='{not json')
+        reply = orjson.loads(await device.receive_from())
+        self.assertEqual(reply, {'status': 'error', 'message': 'Invalid JSON format'})
+        await device.disconnect()
+
+    async def test_batch_viewer_gets_one_frame_per_message(self):
+        viewer = await self.connect(f'/ws/sensors/?token={self.jwt}&batch=1')
+        device, _ = await self.connect_device()
+
+        await self.send_reading(device, {'readings': {'temperature': 30, 'humidity': 50}})
+
+        frame = orjson.loads(await viewer.receive_from())
+        self.assertEqual(frame['type'], 'batch')
+        self.assertEqual([item['sensor_type'] for item in frame['items']],
+                         ['temperature', 'humidity'])
+        self.assertTrue(all(item['type'] == 'sensor_data' for item in frame['items']))
+        self.assertTrue(await viewer.receive_nothing())
+        await viewer.disconnect()
+        await device.disconnect()
+
+    async def test_path_without_trailing_slash(self):
+        device = await self.connect(f'ws/sensors?token={self.device.token}')
+        await device.disconnect()
+
+    async def test_unknown_device_token_is_rejected(self):
+        communicator = WebsocketCommunicator(application, '/ws/sensors/?token=not-a-device')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4001)
+
+    async def test_bad_jwt_is_rejected(self):
+        communicator = WebsocketCommunicator(application, '/ws/sensors/?token=a.b.c')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4001)
+
+
+class WidgetDataConsumerTests(ConsumerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.tracked = TrackedVariable.objects.create(
+            device_id=self.device_uuid, sensor_type='temperature',
+            widget_id='w1', dashboard_uuid='d1', max_samples=3,
+        )
+
+    def stored_values(self):
+        return list(
+            WidgetSample.objects.filter(widget=self.tracked)
+            .order_by('timestamp', 'id').values_list('value', flat=True)
+        )
+
+    async def test_widget_receives_tracked_readings(self):
+        widget = await self.connect(f'/ws/widgets/w1/?token={self.jwt}')
+        device, _ = await self.connect_device()
+
+        await self.send_reading(device, {'readings': {'temperature': 21, 'humidity': 40}})
+
+        update = orjson.loads(await widget.receive_from())
+        self.assertEqual((update['value'], update['unit']), (21, ''))
+        # Untracked humidity never reaches the widget
+        self.assertTrue(await widget.receive_nothing())
+        await widget.disconnect()
+        await device.disconnect()
+
+    async def test_repeated_values_are_stored_once(self):
+        device, _ = await self.connect_device()
+
+        for value in (20, 20, 21, 21, 20):
+            await self.send_reading(device, {
+                'device_id': self.device_uuid, 'sensor_type': 'temperature', 'value': value,
+            })
+        # Disconnecting flushes the widget worker
+        await device.disconnect()
+
+        self.assertEqual(await database_sync_to_async(self.stored_values)(), [20.0, 21.0, 20.0])
+
+    async def test_value_is_stored_after_a_failed_insert(self):
+        device, _ = await self.connect_device()
+        insert_samples = WidgetSample.insert_samples
+        attempts = []
+
+        def fail_first_insert(samples):
+            attempts.append(len(samples))
+            if len(attempts) == 1:
+                raise DatabaseError('insert failed')
+            insert_samples(samples)
+
+        reading = {'device_id': self.device_uuid, 'sensor_type': 'temperature', 'value': 20}
+        with mock.patch.object(WidgetSample, 'insert_samples', side_effect=fail_first_insert):
+            await self.send_reading(device, reading)
+            # Let the widget worker hit the failing insert before retrying
+            for _ in range(200):
+                if attempts:
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(attempts, [1])
+
+            # The same value again is not treated as a duplicate
+            await self.send_reading(device, reading)
+            await device.disconnect()
+
+        self.assertEqual(attempts, [1, 1])
+        self.assertEqual(await database_sync_to_async(self.stored_values)(), [20.0])
+
+    async def test_buffer_is_trimmed_to_max_samples(self):
+        device, _ = await self.connect_device()
+
+        with mock.patch.object(consumers, 'TRIM_EVERY_SAMPLES', 1):
+            for value in range(5):
+                await self.send_reading(device, {
+                    'device_id': self.device_uuid, 'sensor_type': 'temperature', 'value': value,
+                })
+            await device.disconnect()
+
+        self.assertEqual(await database_sync_to_async(self.stored_values)(), [2.0, 3.0, 4.0])
+
+    async def test_path_without_trailing_slash(self):
+        widget = await self.connect(f'ws/widgets/w1?token={self.jwt}')
+        await widget.disconnect()
+
+    async def test_bad_jwt_is_rejected(self):
+        communicator = WebsocketCommunicator(application, '/ws/widgets/w1/?token=a.b.c')
+        connected, code = await communicator.connect()
+        self.assertFalse(connected)
+        self.assertEqual(code, 4001)
+
+
+class DeviceAssignProjectsAPITests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.organization = Organization.objects.create(name='Acme', slug='acme', owner=self.user)
+        OrganizationMember.objects.create(organization=self.organization, user=self.user, role='admin')
+        self.device = Device.objects.create(
+            name='esp32', organization=self.organization, creator=self.user
+        )
+        self.projects = [
+            Project.objects.create(name=f'Line {i}', organization=self.organization, creator=self.user)
+            for i in range(2)
+        ]
+
+        other_user = User.objects.create_user('bob', 'bob@example.com', 'pw')
+        other_organization = Organization.objects.create(name='Other', slug='other', owner=other_user)
+        self.foreign_project = Project.objects.create(
+            name='Not yours', organization=other_organization, creator=other_user
+        )
+
+        self.url = reverse('sensors:device-assign-projects', kwargs={'uuid': self.device.uuid})
+        self.client.force_authenticate(self.user)
+
+    def assign(self, *project_uuids):
+        return self.client.post(
+            self.url, {'project_uuids': [str(u) for u in project_uuids]}, format='json'
+        )
+
+    def assigned_project_ids(self):
+        return set(self.device.projects.values_list('id', flat=True))
+
+    def test_assigns_projects_of_the_device_organization(self):
+        response = self.assign(*(project.uuid for project in self.projects))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['device_uuid'], str(self.device.uuid))
+        self.assertEqual(set(response.data['project_uuids']),
+                         {str(project.uuid) for project in self.projects})
+        self.assertEqual(self.assigned_project_ids(), {project.id for project in self.projects})
+
+    def test_reassignment_is_idempotent(self):
+        self.assign(self.projects[0].uuid)
+
+        response = self.assign(*(project.uuid for project in self.projects))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.device.projects.through.objects.filter(device=self.device).count(), 2)
+        self.assertEqual(self.assigned_project_ids(), {project.id for project in self.projects})
+
+    def test_rejects_projects_of_another_organization(self):
+        response = self.assign(self.projects[0].uuid, self.foreign_project.uuid)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.foreign_project.uuid), response.data['project_uuids'][0])
+        # Nothing is assigned when any project in the batch is rejected
+        self.assertEqual(self.assigned_project_ids(), set())
+
+    def test_rejects_unknown_project(self):
+        unknown = uuid.uuid4()
+
+        response = self.assign(unknown)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(unknown), response.data['project_uuids'][0])
+
+    def test_rejects_empty_list(self):
+        response = self.assign()
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('project_uuids', response.data)
+
+    def test_non_member_cannot_see_the_device(self):
+        outsider = User.objects.create_user('eve', 'eve@example.com', 'pw')
+        self.client.force_authenticate(outsider)
+
+        response = self.assign(self.projects[0].uuid)
+
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.assigned_project_ids(), set())
+
+
+class MqttClusterTopicsAPITests(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        self.cluster = MqttCluster.objects.create(name='Plant', host='broker.local', user=self.user)
+        now = timezone.now()
+        # Newest first: topic/4 ... topic/0
+        self.topics = [
+            MqttTopic.objects.create(
+                cluster=self.cluster, topic_name=f'topic/{i}',
+                last_message_at=now - timedelta(minutes=10 - i),
+            )
+            for i in range(5)
+        ]
+        self.url = reverse('sensors:mqtt-cluster-topics', kwargs={'uuid': self.cluster.uuid})
+        self.client.force_authenticate(self.user)
+
+    def test_topics_are_paged_newest_first(self):
+        response = self.client.get(self.url, {'page_size': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([t['topic_name'] for t in response.data['results']], ['topic/4', 'topic/3'])
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+
+        self.assertEqual([t['topic_name'] for t in response.data['results']], ['topic/2', 'topic/1'])
+
+    def test_default_page_holds_every_topic(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            set(response.data['results'][0]),
+            {'id', 'topic_name', 'message_count', 'last_message_at', 'created_at', 'is_active'},
+        )
+
+    def test_other_users_cluster_is_not_found(self):
+        self.client.force_authenticate(User.objects.create_user('bob', 'bob@example.com', 'pw'))
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_cluster_detail_no_longer_nests_topics(self):
+        response = self.client.get(
+            reverse('sensors:mqtt-cluster-detail', kwargs={'uuid': self.cluster.uuid})
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('topics', response.data)
+        self.assertEqual(response.data['recent_activities'], [])
+        self.assertEqual(response.data['connection_url'], 'mqtt://broker.local:1883')
+
+
+class HandWrittenRepresentationTests(TestCase):
+    """Serializers that build rows by hand must match the ModelSerializer output.
+
+    A field added to Meta.fields but not to the override would otherwise
+    silently disappear from the API.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user('alice', 'alice@example.com', 'pw')
+        cls.cluster = MqttCluster.objects.create(
+            name='Plant', host='broker.local', port=8883, use_ssl=True,
+            username='plant', user=user,
+        )
+        cls.topic = MqttTopic.objects.create(
+            cluster=cls.cluster, topic_name='plant/line1', message_count=7,
+            last_message_at=timezone.now(),
+        )
+        cls.activity = MqttActivity.objects.create(
+            cluster=cls.cluster, activity_type='publish', topic_name='plant/line1',
+            client_id='esp32-1', message_size=42,
+        )
+
+    def assertMatchesModelSerializer(self, serializer_class, instance):
+        serializer = serializer_class()
+        fast = serializer.to_representation(instance)
+        generic = serializers.ModelSerializer.to_representation(serializer, instance)
+
+        self.assertEqual(list(fast), list(serializer_class.Meta.fields))
+        # Compare what clients receive; the overrides may leave UUIDs and
+        # datetimes for the renderer to format
+        render = OrjsonRenderer().render
+        self.assertEqual(orjson.loads(render(fast)), orjson.loads(render(generic)))
+
+    def test_topic_serializer(self):
+        self.assertMatchesModelSerializer(MqttTopicSerializer, self.topic)
+
+    def test_activity_serializer(self):
+        self.assertMatchesModelSerializer(MqttActivitySerializer, self.activity)
+
+    def test_cluster_list_serializer(self):
+        self.assertMatchesModelSerializer(MqttClusterListSerializer, self.cluster)
+
+
+class MqttPasswordSerializerTests(TestCase):
+
+    def is_valid_username(self, username):
+        return MqttPasswordSerializer(data={'username': username, 'password': 'secret-pw'}).is_valid()
+
+    def test_accepts_letters_digits_and_underscores(self):
+        for username in ('alice', 'plant_01', '_line2', 'A_B_C'):
+            self.assertTrue(self.is_valid_username(username), username)
+
+    def test_rejects_other_characters(self):
+        for username in ('alice-1', 'a b', 'user@host', 'a.b'):
+            self.assertFalse(self.is_valid_username(username), username)
+
+    def test_rejects_underscore_only_names(self):
+        for username in ('_', '___'):
+            self.assertFalse(self.is_valid_username(username), username)
@@ -1,12 +1,12 @@
 from django.urls import path, include
 from django.contrib.auth.decorators import login_required
-from rest_framework.routers import DefaultRouter
+from rest_framework.routers import SimpleRouter
 from . import views
 
 app_name = 'sensors'
 
 # Router for ViewSets
-router = DefaultRouter()
+router = SimpleRouter()
 router.register(r'mqtt-clusters', views.MqttClusterViewSet, basename='mqtt-cluster')
 router.register(r'devices', views.DeviceViewSet, basename='device')
 
@@ -4,7 +4,6 @@ Provides end-to-end encryption for ALL sensor data in industrial environments
 """
 
 import base64
-import json
 import secrets
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
 from cryptography.hazmat.backends import default_backend
@@ -21,6 +20,20 @@ except ImportError:
     DJANGO_AVAILABLE = False
     cache = None
 
+def _clone_payload(data):
+    """Copy the parts of a sensor payload that encryption rewrites in place
+
+    Only the top-level dict and the individual readings are modified, so
+    copying those two levels is enough and avoids a JSON round trip.
+    """
+    clone = dict(data)
+    readings = clone.get("readings")
+    if isinstance(readings, list):
+        clone["readings"] = [dict(r) if isinstance(r, dict) else r for r in readings]
+    elif isinstance(readings, dict):
+        clone["readings"] = dict(readings)
+    return clone
+
 class DeviceEncryptionManager:
     """Manages encryption for individual IoT devices"""
     
@@ -73,7 +86,7 @@ class DeviceEncryptionManager:
         """
         try:
             # Clone the data to avoid modifying original
-            encrypted_data = json.loads(json.dumps(data))
+            encrypted_data = _clone_payload(data)
             
             if "readings" in encrypted_data:
                 for reading in encrypted_data["readings"]:
@@ -85,7 +98,7 @@ class DeviceEncryptionManager:
                     reading["encrypted"] = True
                     
                     sensor_type = reading.get("sensor_type", "unknown")
-                    logger.debug(f"Encrypted {sensor_type} sensor value")
+                    logger.debug("Encrypted %s sensor value", sensor_type)
             
             elif "value" in encrypted_data:
                 # Single reading format - encrypt the value
@@ -96,7 +109,7 @@ class DeviceEncryptionManager:
             return encrypted_data
             
         except Exception as e:
-            logger.error(f"Encryption failed: {e}")
+            logger.error("Encryption failed: %s", e)
             # Return original data if encryption fails (graceful degradation)
             return data
     
@@ -106,7 +119,7 @@ class DeviceEncryptionManager:
         """
         try:
             # Clone the data to avoid modifying original
-            decrypted_data = json.loads(json.dumps(data))
+            decrypted_data = _clone_payload(data)
             
             if "readings" in decrypted_data:
                 for reading in decrypted_data["readings"]:
@@ -138,7 +151,7 @@ class DeviceEncryptionManager:
             return decrypted_data
             
         except Exception as e:
-            logger.error(f"Decryption failed: {e}")
+            logger.error("Decryption failed: %s", e)
             # Return original data if decryption fails
             return data
     
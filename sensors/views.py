@@ -6,17 +6,21 @@ from django.conf import settings
 from rest_framework import generics, filters, status, viewsets, serializers
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiParameter
 from drf_spectacular.openapi import OpenApiTypes
+from django.db.models import F
 from .models import MqttCluster, MqttTopic, MqttActivity, Device
+from .consumers import forget_device_token
 from user.models import MosquittoUser, UserProfile, Organization
 from .serializers import (
     MqttClusterSerializer, MqttClusterListSerializer,
     MqttTopicSerializer, MqttActivitySerializer, ACLSerializer,
     MqttPasswordSerializer, DeviceSerializer, DeviceListSerializer,
-    DeviceCreateSerializer, DeviceUpdateSerializer, DeviceProjectAssignmentSerializer
+    DeviceCreateSerializer, DeviceUpdateSerializer, DeviceProjectAssignmentSerializer,
+    DeviceProjectBulkAssignmentSerializer, MQTT_USERNAME_RE
 )
 import json
 import secrets
@@ -113,7 +117,7 @@ def set_mqtt_password(request):
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Validate username format (alphanumeric and underscores only)
-        if not username.replace('_', '').isalnum():
+        if not MQTT_USERNAME_RE.fullmatch(username):
             return Response({
                 'error': 'Username can only contain letters, numbers, and underscores'
             }, status=status.HTTP_400_BAD_REQUEST)
@@ -408,6 +412,13 @@ def acl_detail(request, acl_id):
 
 # MQTT Cluster Management Views
 
+class MqttTopicPagination(PageNumberPagination):
+    """Pages for a cluster's topic list, which can grow without bound"""
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+
 @extend_schema_view(
     list=extend_schema(
         operation_id='list_mqtt_clusters',
@@ -454,7 +465,18 @@ class MqttClusterViewSet(viewsets.ModelViewSet):
     
     def get_queryset(self):
         """Return clusters for the current user"""
-        return MqttCluster.objects.filter(user=self.request.user).order_by('-created_at')
+        queryset = MqttCluster.objects.filter(user=self.request.user).order_by('-created_at')
+        if self.action == 'list':
+            # Only the columns MqttClusterListSerializer renders
+            queryset = queryset.only(
+                'uuid', 'name', 'cluster_type', 'host', 'port', 'use_ssl',
+                'username', 'description', 'is_active', 'created_at',
+                'total_topics', 'total_messages', 'total_subscriptions',
+            )
+        elif self.action in ('retrieve', 'update', 'partial_update'):
+            # Nested recent activities of MqttClusterSerializer
+            queryset = queryset.prefetch_related(MqttClusterSerializer.recent_activities_prefetch())
+        return queryset
     
     def get_serializer_class(self):
         """Use different serializers for list vs detail views"""
@@ -526,6 +548,21 @@ class MqttClusterViewSet(viewsets.ModelViewSet):
         
         # Delete the cluster record
         return super().destroy(request, *args, **kwargs)
+    
+    @extend_schema(
+        operation_id='list_mqtt_cluster_topics',
+        tags=['MQTT'],
+        summary='List MQTT Cluster Topics',
+        description='Paginated topics of an MQTT cluster, most recently active first',
+        responses=MqttTopicSerializer(many=True)
+    )
+    @action(detail=True, methods=['get'], pagination_class=MqttTopicPagination)
+    def topics(self, request, uuid=None):
+        """List this cluster's topics a page at a time"""
+        cluster = self.get_object()
+        topics = MqttTopic.objects.filter(cluster=cluster).order_by('-last_message_at', '-id')
+        page = self.paginate_queryset(topics)
+        return self.get_paginated_response(MqttTopicSerializer(page, many=True).data)
 
 
 @extend_schema(
@@ -569,7 +606,7 @@ def mqtt_cluster_test_connection(request, cluster_uuid):
     """Test actual MQTT connection to a cluster with proper MQTT client"""
     
     try:
-        cluster = MqttCluster.objects.get(uuid=cluster_uuid, user=request.user)
+        cluster = MqttCluster.objects.with_password().get(uuid=cluster_uuid, user=request.user)
     except MqttCluster.DoesNotExist:
         return Response({'error': 'Cluster not found'}, status=404)
     
@@ -888,7 +925,13 @@ class DeviceViewSet(viewsets.ModelViewSet):
         user = self.request.user
         # Get organizations where user is a member
         user_orgs = Organization.objects.filter(members__user=user)
-        queryset = Device.objects.filter(organization__in=user_orgs)
+        queryset = (
+            Device.objects.with_project_counts()
+            .select_related('organization', 'creator')
+            .filter(organization__in=user_orgs)
+        )
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related('projects')
         
         # Filter by organization if specified
         org_id = self.request.query_params.get('organization')
@@ -902,6 +945,21 @@ class DeviceViewSet(viewsets.ModelViewSet):
         
         return queryset.distinct()
     
+    def list(self, request, *args, **kwargs):
+        # Every DeviceListSerializer field is a column or annotation, so build
+        # the response items with values() instead of serializing each row
+        queryset = self.filter_queryset(self.get_queryset())
+        rows = queryset.values(
+            'uuid', 'name', 'description', 'status', 'last_seen',
+            'project_count', 'is_active', 'created_at', 'updated_at',
+            organization_name=F('organization__name'),
+            creator_name=F('creator__username'),
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(list(rows))
+    
     def get_serializer_class(self):
         if self.action == 'list':
             return DeviceListSerializer
@@ -933,6 +991,7 @@ class DeviceViewSet(viewsets.ModelViewSet):
             raise serializers.ValidationError("You don't have permission to delete this device")
         
         # TODO: Add cleanup for associated sensor data if needed
+        forget_device_token(instance.token)
         instance.delete()
     
     @extend_schema(
@@ -994,6 +1053,52 @@ class DeviceViewSet(viewsets.ModelViewSet):
         
         return Response(serializer.errors, status=400)
     
+    @extend_schema(
+        operation_id='assign_device_to_projects',
+        tags=['Devices'],
+        summary='Assign Device to Projects',
+        description='Assign a device to several projects within the same organization in one request',
+        request=DeviceProjectBulkAssignmentSerializer,
+        responses={
+            200: {
+                'type': 'object',
+                'properties': {
+                    'message': {'type': 'string'},
+                    'device_uuid': {'type': 'string'},
+                    'project_uuids': {'type': 'array', 'items': {'type': 'string'}}
+                }
+            },
+            400: {'type': 'object', 'properties': {'error': {'type': 'string'}}},
+            403: {'type': 'object', 'properties': {'error': {'type': 'string'}}}
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def assign_projects(self, request, uuid=None):
+        """Assign device to several projects"""
+        device = self.get_object()
+        
+        # Check permission
+        if not device.organization.members.filter(user=request.user).exists():
+            return Response({'error': 'Permission denied'}, status=403)
+        
+        serializer = DeviceProjectBulkAssignmentSerializer(
+            data=request.data,
+            context={'device': device}
+        )
+        
+        if serializer.is_valid():
+            projects = serializer.validated_data['projects']
+            # Validation already matched the device's organization
+            device.projects.add(*projects)
+            
+            return Response({
+                'message': 'Device assigned to projects successfully',
+                'device_uuid': str(device.uuid),
+                'project_uuids': [str(project.uuid) for project in projects]
+            })
+        
+        return Response(serializer.errors, status=400)
+    
     @extend_schema(
         operation_id='unassign_device_from_project',
         tags=['Devices'],
@@ -1103,6 +1208,7 @@ def regenerate_device_token(request, device_uuid):
             return Response({'error': 'Permission denied'}, status=403)
         
         # Generate new token
+        forget_device_token(device.token)
         device.token = secrets.token_urlsafe(32)
         device.save()
         
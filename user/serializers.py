@@ -136,6 +136,15 @@ class ProjectSerializer(serializers.ModelSerializer):
         return obj.get_dashboard_count()
 
 
+class ProjectListSerializer(serializers.ModelSerializer):
+    """Flat project summary for nesting under other resources"""
+    
+    class Meta:
+        model = Project
+        fields = ('uuid', 'id', 'name', 'description', 'status', 'is_active', 'created_at')
+        read_only_fields = fields
+
+
 class CreateProjectSerializer(serializers.ModelSerializer):
     organization_id = serializers.IntegerField(write_only=True)
     
@@ -1793,16 +1793,24 @@ def project_detail_view(request, project_uuid):
 def widget_samples_view(request, template_uuid, widget_id):
     from sensors.models import TrackedVariable, WidgetSample
     try:
-        tv = TrackedVariable.objects.filter(widget_id=widget_id, dashboard_uuid=template_uuid).first()
+        tv = (
+            TrackedVariable.objects.filter(widget_id=widget_id, dashboard_uuid=template_uuid)
+            .only('id', 'max_samples')
+            .first()
+        )
         if not tv:
             return Response({'data': [], 'widget_id': widget_id})
-        samples = WidgetSample.objects.filter(widget=tv).order_by('-timestamp')[:tv.max_samples]
+        samples = (
+            WidgetSample.objects.filter(widget_id=tv.id)
+            .order_by('-timestamp', '-id')
+            .values_list('timestamp', 'value', 'unit')[:tv.max_samples]
+        )
         data = [
             {
-                'timestamp': s.timestamp.isoformat(),
-                'value': s.value,
-                'unit': s.unit
-            } for s in reversed(samples)  # oldest→newest
+                'timestamp': timestamp.isoformat(),
+                'value': value,
+                'unit': unit
+            } for timestamp, value, unit in reversed(samples)  # oldest→newest
         ]
         return Response({'widget_id': widget_id, 'data': data})
     except Exception as e: